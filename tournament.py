@@ -1,4 +1,3 @@
-import psycopg2
 """
     tournament.py -- implementation of a Swiss-system tournament.
 
@@ -15,10 +14,16 @@ import psycopg2
         count_players(tournament_id): counts # of players in given
         tournament
         register_player(name): registers player
+        register_players(names): registers several players at once
         player_standings(tournament_id):  returns the current standings
         report_match(winner, loser, tournament_id): report match results
+        report_matches(pairs, tournament_id): report several match
+        results at once
+        bulk_report_matches(rows): stream many match results (of any
+        tournaments) into the database with COPY
         swiss_pairings(tournament_id): calculates appropriate match
-        pairings
+        pairings (cached per process -- deployments where several
+        processes write to the database must not rely on it)
 
 
     Quick Start:
@@ -31,51 +36,124 @@ import psycopg2
             matchups that satisfies the Swiss-system property.
 
     To Do -- Future Implementations:
-        1)  Maybe just add another table: player's wins, loses -- this
-            will make the player_standings() function a lot easier.
-        2)  Add features: support for odd-number players; support ties
+        1)  Add features: support for odd-number players; support ties
             as a match result.
-        3)  Since matches table is dependant on players table, we could
-            call delete_matches() inside delete_players()
 """
 __author__ = 'Deepankara Reddy'
 
+import contextlib
+import cStringIO
+import operator
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extras import execute_values
+
+DATABASE_NAME = "tournament"
+MAX_CONNECTIONS = 25
+
+# the most frequently executed statements are parsed & planned once per
+# connection and then only executed (see register_player, report_match):
+_PREPARED_STATEMENTS = """
+    PREPARE ins_player(text) AS
+        INSERT INTO players(name) VALUES($1) RETURNING id;
+    PREPARE ins_match(int, int, int) AS
+        INSERT INTO matches(winner_id, loser_id, tournament_id)
+        VALUES($1, $2, $3);"""
+
+
+class _TournamentConnection(psycopg2.extensions.connection):
+    """Connection that prepares the _PREPARED_STATEMENTS when opened.
+
+    Connections are in autocommit mode: every API function issues a
+    single statement, which is atomic on its own, so the extra BEGIN &
+    COMMIT round trips of an explicit transaction are not needed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_TournamentConnection, self).__init__(*args, **kwargs)
+        self.autocommit = True
+        cursor = self.cursor()
+        cursor.execute(_PREPARED_STATEMENTS)
+
+
+# connections are reused across calls instead of being opened & closed
+# (i.e. a new TCP handshake & authentication) for every query:
+_POOL = psycopg2.pool.ThreadedConnectionPool(
+    minconn=1, maxconn=MAX_CONNECTIONS, dbname=DATABASE_NAME,
+    connection_factory=_TournamentConnection)
+# (the pool raises PoolError when exhausted -- callers wait here instead)
+_POOL_SLOTS = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+# swiss_pairings() results are cached (in this process) until a write
+# changes the standings; the version is bumped by every such write so
+# that pairings computed concurrently with a write are never cached:
+_pairings_lock = threading.Lock()
+_pairings_cache = {}
+_standings_version = 0
 
-def connect(database_name="tournament"):
-    """Connect to PostgreSQL database. Returns connection and cursor."""
+
+@contextlib.contextmanager
+def connect():
+    """Borrow a connection from the pool. Yields connection and cursor.
+
+    The connection is returned to the pool (not closed) on exit. If all
+    connections are in use, waits until one is returned.
+    """
+    _POOL_SLOTS.acquire()
     try:
-        db = psycopg2.connect("dbname={}".format(database_name))
-        cursor = db.cursor()
-        return db, cursor
-    except:
-        print "Error while trying to connect to database"
+        db = _POOL.getconn()
+        try:
+            yield db, db.cursor()
+        finally:
+            _POOL.putconn(db)
+    finally:
+        _POOL_SLOTS.release()
+
+
+def _invalidate_pairings():
+    """Forget cached swiss_pairings() results. Call after every write."""
+    global _standings_version
+
+    with _pairings_lock:
+        _standings_version += 1
+        _pairings_cache.clear()
 
 
 def delete_matches():
     """Removes all the match records and from database."""
 
-    db, cursor = connect()
-    cursor.execute("""TRUNCATE matches;""")
-    db.commit()
-    db.close()
+    with connect() as (db, cursor):
+        cursor.execute("""TRUNCATE matches, player_records;""")
+
+    _invalidate_pairings()
 
 
 def delete_players():
     """Removes all the player as well as match records from database."""
 
-    db, cursor = connect()
-    cursor.execute("""TRUNCATE players CASCADE;""")
-    db.commit()
-    db.close()
+    with connect() as (db, cursor):
+        # (matches & player_records tables are dependant on players
+        # table, so CASCADE also truncates them -- no need to call
+        # delete_matches() first)
+        cursor.execute("""TRUNCATE players CASCADE;""")
 
+    _invalidate_pairings()
 
-def count_players(tournament_id=0):
+
+def count_players(tournament_id=0, exact=True):
     """Returns the number of players currently registered in selected
     tournament. If no arguments are given, then function returns the
     count of all registered players.
 
     Args:
         tournament_id: the id (integer) of the tournament.
+        exact: if False, returns the planner's estimate of the number of
+        registered players instead of counting them -- defaults to
+        True. Only applies to the count of all registered players (i.e.
+        tournament_id = 0); tournament counts are always exact.
 
     Returns:
         An integer of the number of registered players if tournament_id
@@ -84,22 +162,20 @@ def count_players(tournament_id=0):
         played at least 1 game).
     """
 
-    db, cursor = connect()
-
-    if tournament_id == 0:
-        cursor.execute("""SELECT COUNT(id) FROM players;""")
-    else:
-        cursor.execute("""SELECT CAST(COUNT(subQuery.X) AS INTEGER) FROM
-                    (SELECT winner_id AS X
-                     FROM matches WHERE matches.tournament_id = %s
-                     UNION
-                     SELECT loser_id AS X
-                     FROM matches WHERE matches.tournament_id = %s)
-                     AS subQuery;""", (tournament_id, tournament_id))
+    with connect() as (db, cursor):
+        if tournament_id == 0 and not exact:
+            # (estimate kept by VACUUM/ANALYZE -- no table scan needed;
+            # it is -1 if the table has never been analyzed)
+            cursor.execute("""SELECT GREATEST(reltuples, 0)::bigint
+                        FROM pg_class
+                        WHERE oid = 'players'::regclass;""")
+        elif tournament_id == 0:
+            cursor.execute("""SELECT COUNT(id) FROM players;""")
+        else:
+            cursor.execute("""SELECT COUNT(player_id) FROM player_records
+                        WHERE tournament_id = %s;""", (tournament_id,))
 
-    output_ = cursor.fetchone()[0]
-    db.close()
-    return output_
+        return cursor.fetchone()[0]
 
 
 def register_player(name):
@@ -109,27 +185,47 @@ def register_player(name):
         name: the player's full name (need not be unique).
     """
 
-    db, cursor = connect()
-
-    # add player to players table and return its id:
-    query = "INSERT INTO players(name) VALUES(%s) RETURNING id;"
-    param = (name,)
-    cursor.execute(query, param)
-    return_id = cursor.fetchone()[0]
+    with connect() as (db, cursor):
+        # add player to players table and return its id:
+        query = "EXECUTE ins_player(%s);"
+        param = (name,)
+        cursor.execute(query, param)
+        return_id = cursor.fetchone()[0]
 
-    db.commit()
-    db.close()
+    _invalidate_pairings()
     return return_id
 
 
+def register_players(names):
+    """Adds several players to the tournament database in one round trip.
+
+    Args:
+        names: a list of the players' full names (need not be unique).
+
+    Returns:
+        A list of the new players' ids, in the same order as names.
+    """
+
+    with connect() as (db, cursor):
+        # add all players to players table and return their ids:
+        query = """INSERT INTO players(name)
+                   SELECT unnest(%s::text[]) RETURNING id;"""
+        param = (list(names),)
+        cursor.execute(query, param)
+        return_ids = [row[0] for row in cursor.fetchall()]
+
+    _invalidate_pairings()
+    return return_ids
+
+
 def player_standings(tournament_id=0):
     """Returns a list of the players & their win record, sorted by rank.
 
     The first entry in the returned list is the person in first place,
     or a player tied for first place if there is currently a tie. Due to
     the requirements of the test cases to return standings before any
-    matches have been played, if tournament_id is not specified (i.e.
-    tournament_id = 0), the function returns all registered players
+    matches have been played, if no matches have been played in given
+    tournament_id, the function returns all registered players
     regardless of what tournament they are participating in; otherwise,
     the function returns standings of only the players that have played
     at least 1 game in given tournament_id.
@@ -146,49 +242,17 @@ def player_standings(tournament_id=0):
         played.
     """
 
-    db, cursor = connect()
-
-    # check how many matches have been played:
-    query = """SELECT COUNT(match_id) FROM matches
-               WHERE matches.tournament_id = %s;"""
-    param = (tournament_id,)
-    cursor.execute(query, param)
-    total_matches = cursor.fetchone()[0]
-
-    # if no matches have been played, return registered players:
-    if total_matches == 0:
-        cursor.execute("""SELECT id, name, 0, 0 FROM players;""")
-        output_ = cursor.fetchall()
-        db.close()
-        return output_
-
-    # see the views schema, as those are executed before the following:
-
-    # Joins tables and returns standings -- sorted by wins, omw:
-    # if tournament_id is specified, returns only players that have
-    # played in that specific tournament:
-    if tournament_id != 0:
-        tournament_restriction = 'AND games_played > 0'
-    else:
-        tournament_restriction = ''
-    # (subquery combines wins-count data with opponent wins (omw) &
-    # select number of games played)
-    cursor.execute("""SELECT subQuery.id, subQuery.name, wins,
-             CAST(games_played AS INTEGER)
-             FROM num_matches,
-                  (SELECT games_won.id AS id, name,
-                   CAST(wins AS INTEGER),
-                   COALESCE(opponent_wins, 0) AS opponent_wins
-                   FROM games_won LEFT JOIN omw
-                   ON id = x)
-                   AS subQuery
-             WHERE (subQuery.id = num_matches.id) %s
-             ORDER BY wins DESC, opponent_wins DESC,
-             games_played ASC;""" % tournament_restriction)
-
-    output_ = cursor.fetchall()
-    db.close()
-    return output_
+    with connect() as (db, cursor):
+        # see the standings() function schema -- it ranks the players
+        # that have played in given tournament by wins, omw (or returns
+        # all registered players if no matches have been played yet):
+        query = """SELECT id, name, wins, games_played
+                   FROM standings(%(tournament_id)s)
+                   ORDER BY rank;"""
+        param = {'tournament_id': tournament_id}
+        cursor.execute(query, param)
+
+        return cursor.fetchall()
 
 
 def report_match(winner, loser, tournament_id=0):
@@ -200,16 +264,74 @@ def report_match(winner, loser, tournament_id=0):
         tournament_id:  the match's tournament id
     """
 
-    db, cursor = connect()
+    with connect() as (db, cursor):
+        # Add players into matches table:
+        query = "EXECUTE ins_match(%s, %s, %s);"
+        param = (winner, loser, tournament_id)
+        cursor.execute(query, param)
+
+    _invalidate_pairings()
+
+
+def report_matches(pairs, tournament_id=0):
+    """Records the outcomes of several matches (e.g. a full round) at once.
+
+    All matches are inserted with a single statement, so reporting a
+    round costs one round trip to the database instead of one per match.
+
+    Args:
+        pairs:  a list of (winner, loser) tuples of player id numbers
+        tournament_id:  the tournament id of every match in pairs
+    """
+
+    rows = [(winner, loser, tournament_id) for winner, loser in pairs]
+    if not rows:
+        return
+
+    with connect() as (db, cursor):
+        # Add all players into matches table with one multi-row INSERT
+        # (a single page, so that the round is recorded atomically):
+        query = "INSERT INTO matches (winner_id, loser_id, tournament_id) \
+                VALUES %s;"
+        execute_values(cursor, query, rows, page_size=len(rows))
+
+    _invalidate_pairings()
 
-    # Add players into matches table:
-    query = "INSERT INTO matches (winner_id, loser_id, tournament_id) \
-            VALUES(%s, %s, %s);"
-    param = (winner, loser, tournament_id)
-    cursor.execute(query, param)
 
-    db.commit()
-    db.close()
+def bulk_report_matches(rows):
+    """Records the outcomes of many matches, e.g. when importing results.
+
+    The matches are streamed to the database with COPY, which avoids the
+    per-row overhead of INSERT statements altogether.
+
+    Args:
+        rows:  an iterable of (winner, loser, tournament_id) tuples
+
+    Raises:
+        TypeError: if an id is not an integer.
+    """
+
+    # (ids must be integers -- operator.index() raises TypeError for
+    # anything else, e.g. floats or strings -- so that no value can be
+    # truncated or inject extra columns or rows into the COPY stream)
+    buf = cStringIO.StringIO()
+    # (rows are stably sorted by tournament, as the record_match trigger
+    # locks each tournament in turn -- concurrent imports then take the
+    # locks in the same order and cannot deadlock; standings do not
+    # depend on the order in which a tournament's matches are inserted)
+    rows = sorted(rows, key=operator.itemgetter(2))
+    buf.writelines("{}\t{}\t{}\n".format(operator.index(winner),
+                                           operator.index(loser),
+                                           operator.index(tournament_id))
+                   for winner, loser, tournament_id in rows)
+    buf.seek(0)
+
+    with connect() as (db, cursor):
+        # Add all players into matches table with one COPY stream:
+        columns = ('winner_id', 'loser_id', 'tournament_id')
+        cursor.copy_from(buf, 'matches', columns=columns)
+
+    _invalidate_pairings()
 
 
 def swiss_pairings(tournament_id=0):
@@ -218,7 +340,10 @@ def swiss_pairings(tournament_id=0):
     Assuming that there are an even number of players registered, each
     player appears exactly once in the pairings.  Each player is paired
     with another player with an equal or nearly-equal win record, that
-    is, a player adjacent to him in the standings.
+    is, a player adjacent to him in the standings. Results are cached
+    in this process; only writes made by this module's functions in the
+    same process invalidate the cache -- writes from other processes or
+    made directly in SQL do not.
 
     Returns:
         A list of tuples, each containing (id1, name1, id2, name2)
@@ -228,15 +353,36 @@ def swiss_pairings(tournament_id=0):
         name2: the second player's name
     """
 
-    standings = player_standings(tournament_id)
-
-    pairings = []
-    iii = 1
-    while iii < len(standings):
-        tup1 = standings[iii-1]
-        tup2 = standings[iii]
-
-        pairings.append(tuple((tup1[0], tup1[1], tup2[0], tup2[1])))
-        iii += 2
-
-    return pairings
+    # pairings only change when standings do, so repeated calls between
+    # rounds are answered from the cache:
+    with _pairings_lock:
+        version = _standings_version
+        pairings = _pairings_cache.get(tournament_id)
+
+    if pairings is None:
+        pairings = _compute_pairings(tournament_id)
+        with _pairings_lock:
+            if version == _standings_version:
+                _pairings_cache[tournament_id] = pairings
+
+    return list(pairings)
+
+
+def _compute_pairings(tournament_id):
+    """Queries the database for swiss_pairings() of given tournament."""
+
+    with connect() as (db, cursor):
+        # ranks players the same way as player_standings() (see the
+        # standings() function schema) and pairs each odd-ranked player
+        # with the next one down:
+        query = """WITH ranked AS (
+                       SELECT id, name, rank AS rn
+                       FROM standings(%(tournament_id)s))
+                   SELECT a.id, a.name, b.id, b.name
+                   FROM ranked AS a JOIN ranked AS b ON b.rn = a.rn + 1
+                   WHERE a.rn %% 2 = 1
+                   ORDER BY a.rn;"""
+        param = {'tournament_id': tournament_id}
+        cursor.execute(query, param)
+
+        return cursor.fetchall()
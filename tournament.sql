@@ -48,68 +48,197 @@ CREATE TABLE matches(match_id SERIAL PRIMARY KEY,
                      winner_id INTEGER REFERENCES players(id),
                      loser_id INTEGER REFERENCES players(id));
 
+-- Indexes for the record_match trigger's lookups of a player's previous
+-- matches (as winner & as loser) in a tournament:
+CREATE INDEX matches_tournament_winner
+    ON matches (tournament_id, winner_id, loser_id);
+CREATE INDEX matches_tournament_loser
+    ON matches (tournament_id, loser_id, winner_id);
+
+
+/*    Running record of every player in every tournament they have
+    played in. Rows are kept up to date by the record_match trigger
+    whenever a match is inserted, so standings are read straight from
+    this table instead of re-aggregating all matches on every call.
+
+    Columns:
+        tournament_id: tournament id
+        player_id: id of player
+        wins: number of matches won in tournament
+        games_played: number of matches played in tournament
+        opponent_wins: opponent match wins (omw) in tournament -- the
+            sum of the wins of every opponent the player has played
+*/
+CREATE TABLE player_records(tournament_id INTEGER,
+                            player_id INTEGER REFERENCES players(id),
+                            wins INTEGER NOT NULL DEFAULT 0,
+                            games_played INTEGER NOT NULL DEFAULT 0,
+                            opponent_wins INTEGER NOT NULL DEFAULT 0,
+                            PRIMARY KEY (tournament_id, player_id));
+
+-- Index matching the standings order (see standings()):
+CREATE INDEX player_records_standings
+    ON player_records (tournament_id, wins DESC, opponent_wins DESC,
+                       games_played ASC, player_id ASC);
+
 
 -------------------------------------------
--- CREATE VIEWS                          --
+-- CREATE FUNCTIONS                      --
 -------------------------------------------
 
--- Views used for player_standings:
-
--- Find number of matches played per player:
+-- Standings of given tournament, used by both player_standings() &
+-- swiss_pairings(): players who have played in the tournament, ranked
+-- by wins, omw, fewest games & id -- or, if no matches have been played
+-- in it yet, all registered players (ranked by id):
 CREATE
-    OR REPLACE VIEW num_matches AS
-
-SELECT players.id
-    ,COALESCE(COUNT(players.id), 0) AS games_played
-FROM players
-    ,matches
-WHERE (
-        players.id = winner_id
-        OR players.id = loser_id
-        )
-    AND matches.tournament_id = tournament_id
-GROUP BY players.id
-ORDER BY games_played DESC;
-
-
--- Find number of matches won per player:
-CREATE
-    OR REPLACE VIEW games_won AS
-
-SELECT players.id AS id
-    ,players.NAME
-    ,COUNT(subQuery.winner_id) AS wins
-FROM players
-LEFT JOIN (
-    SELECT winner_id
-    FROM matches
-    WHERE matches.tournament_id = tournament_id
-    ) AS subQuery ON players.id = subQuery.winner_id
-GROUP BY players.id;
-
-
--- Find opponent match wins (omw):
--- (subquery creates 2 columns of id & every opponent he has played)
-CREATE
-    OR REPLACE VIEW omw AS
-
-SELECT x
-    ,CAST(SUM(wins) AS INT) AS opponent_wins
-FROM games_won
-    ,(
-        SELECT winner_id AS x
-            ,loser_id AS opponent
-        FROM matches
-        WHERE matches.tournament_id = tournament_id
+    OR REPLACE FUNCTION standings(tournament INTEGER)
+    RETURNS TABLE (
+        id INTEGER
+        ,name TEXT
+        ,wins INTEGER
+        ,games_played INTEGER
+        ,rank BIGINT
+        ) AS $$
+
+SELECT subQuery.id
+    ,subQuery.name
+    ,subQuery.wins
+    ,subQuery.games_played
+    ,ROW_NUMBER() OVER (
+        ORDER BY subQuery.wins DESC
+            ,subQuery.opponent_wins DESC
+            ,subQuery.games_played ASC
+            ,subQuery.id ASC
+        ) AS rank
+FROM (
+    SELECT player_records.player_id AS id
+        ,players.name
+        ,player_records.wins
+        ,player_records.games_played
+        ,player_records.opponent_wins
+    FROM player_records
+    INNER JOIN players ON players.id = player_records.player_id
+    WHERE player_records.tournament_id = tournament
+
+    UNION ALL
+
+    SELECT players.id
+        ,players.name
+        ,0
+        ,0
+        ,0
+    FROM players
+    WHERE NOT EXISTS (
+            SELECT 1
+            FROM player_records
+            WHERE player_records.tournament_id = tournament
+            )
+    ) AS subQuery;
+
+$$ LANGUAGE sql STABLE;
 
-        UNION
 
-        SELECT loser_id AS x
-            ,winner_id AS opponent
+-------------------------------------------
+-- CREATE TRIGGERS                       --
+-------------------------------------------
+
+-- Update player_records with the result of a new match:
+-- (runs BEFORE INSERT, so the new match -- unlike earlier rows of the
+-- same multi-row INSERT or COPY -- is not yet visible in matches)
+CREATE
+    OR REPLACE FUNCTION record_match() RETURNS TRIGGER AS $$
+
+DECLARE
+    rematch BOOLEAN;
+
+BEGIN
+    -- Matches of the same tournament are recorded one at a time (the
+    -- lock is held until the inserting transaction ends), so that the
+    -- following statements -- each taking a fresh snapshot -- see every
+    -- concurrently reported match, and so that player_records rows of
+    -- a tournament are never updated by two transactions at once.
+    -- A transaction inserting matches of several tournaments takes one
+    -- lock per tournament; callers must insert them ordered by
+    -- tournament_id (as bulk_report_matches() does) so that all
+    -- transactions take these locks in the same order (no deadlocks):
+    PERFORM pg_advisory_xact_lock(NEW.tournament_id);
+
+    -- Have these players met before in this tournament?
+    rematch := EXISTS (
+        SELECT 1
         FROM matches
-        WHERE matches.tournament_id = tournament_id
-        ORDER BY x ASC
-        ) AS subQuery
-WHERE id = opponent
-GROUP BY x
-ORDER BY x;
+        WHERE tournament_id = NEW.tournament_id
+            AND (
+                (
+                    winner_id = NEW.winner_id
+                    AND loser_id = NEW.loser_id
+                    )
+                OR (
+                    winner_id = NEW.loser_id
+                    AND loser_id = NEW.winner_id
+                    )
+                )
+        );
+
+    INSERT INTO player_records (tournament_id, player_id)
+    VALUES (NEW.tournament_id, NEW.winner_id)
+        ,(NEW.tournament_id, NEW.loser_id)
+    ON CONFLICT DO NOTHING;
+
+    UPDATE player_records
+    SET wins = wins + 1
+        ,games_played = games_played + 1
+    WHERE tournament_id = NEW.tournament_id
+        AND player_id = NEW.winner_id;
+
+    UPDATE player_records
+    SET games_played = games_played + 1
+    WHERE tournament_id = NEW.tournament_id
+        AND player_id = NEW.loser_id;
+
+    -- Every previous opponent of the winner gains an opponent win:
+    UPDATE player_records
+    SET opponent_wins = opponent_wins + 1
+    WHERE tournament_id = NEW.tournament_id
+        AND player_id IN (
+            SELECT loser_id
+            FROM matches
+            WHERE tournament_id = NEW.tournament_id
+                AND winner_id = NEW.winner_id
+
+            UNION
+
+            SELECT winner_id
+            FROM matches
+            WHERE tournament_id = NEW.tournament_id
+                AND loser_id = NEW.winner_id
+            );
+
+    -- A new opponent adds all of their wins to the player's omw:
+    IF NOT rematch THEN
+        UPDATE player_records AS record
+        SET opponent_wins = record.opponent_wins + opponent.wins
+        FROM player_records AS opponent
+        WHERE record.tournament_id = NEW.tournament_id
+            AND opponent.tournament_id = NEW.tournament_id
+            AND (
+                (
+                    record.player_id = NEW.winner_id
+                    AND opponent.player_id = NEW.loser_id
+                    )
+                OR (
+                    record.player_id = NEW.loser_id
+                    AND opponent.player_id = NEW.winner_id
+                    )
+                );
+    END IF;
+
+    RETURN NEW;
+END;
+
+$$ LANGUAGE plpgsql;
+
+
+CREATE TRIGGER record_match BEFORE INSERT
+    ON matches
+    FOR EACH ROW EXECUTE PROCEDURE record_match();
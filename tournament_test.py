@@ -139,6 +139,133 @@ def test_pairings():
     print "8. After one match, players with one win are paired."
 
 
+def test_omw():
+    delete_players()
+    names = ["Rarity", "Spike", "Starlight Glimmer", "Trixie",
+             "Big McIntosh", "Zecora", "Discord", "Cheerilee",
+             "Derpy Hooves", "Granny Smith"]
+    [id0, id1, id2, id3, id4, id5, id6, id7, id8, id9] = \
+        register_players(names)
+    pairs = [(id0, id9), (id1, id8), (id2, id7), (id3, id6), (id4, id5),
+             (id1, id6), (id2, id0), (id0, id5), (id8, id4), (id6, id0),
+             (id0, id3), (id4, id9), (id7, id3), (id6, id2)]
+    bulk_report_matches([(winner, loser, 0) for winner, loser in pairs])
+    standings = player_standings()
+    if len(standings) != 10:
+        raise ValueError("Each player who has played should appear in \
+                         playerStandings.")
+    correct = [id0, id6, id2, id1, id4, id3, id8, id7]
+    user_results = [row[0] for row in standings[:8]]
+    if correct != user_results:
+        raise ValueError("Players with equal wins should be ranked by \
+                         Opponent Match Wins.")
+    print "9. Players with equal wins are ranked by Opponent Match Wins."
+
+
+def test_rematch_and_tournaments():
+    delete_players()
+    names = ["Applebloom", "Scootaloo", "Sweetie Belle", "Babs Seed",
+             "Diamond Tiara", "Silver Spoon"]
+    [id0, id1, id2, id3, id4, id5] = register_players(names)
+    # id1 & id2 meet twice in tournament 1:
+    for (winner, loser) in [(id1, id2), (id3, id2), (id0, id4), (id2, id1),
+                            (id3, id0), (id1, id0), (id2, id4), (id4, id5)]:
+        report_match(winner, loser, 1)
+    # results in tournament 0 must not affect tournament 1:
+    for (winner, loser) in [(id2, id1), (id2, id3), (id4, id0), (id1, id2)]:
+        report_match(winner, loser)
+    if count_players(1) != 6:
+        raise ValueError("count_players(1) should count the six players \
+                         of tournament 1.")
+    if len(player_standings()) != 5:
+        raise ValueError("Only players of tournament 0 should appear in \
+                         its standings.")
+    correct = [id2, id3, id1, id0, id4, id5]
+    user_results = [row[0] for row in player_standings(1)]
+    if correct != user_results:
+        raise ValueError("A rematch should count each opponent's wins \
+                         only once, per tournament.")
+    print "10. Rematches & multiple tournaments are ranked separately."
+
+
+def test_report_round():
+    delete_players()
+    [id1, id2, id3, id4] = register_players(["Maud Pie", "Limestone Pie",
+                                             "Marble Pie", "Igneous Rock"])
+    report_matches([])
+    for (i, n, w, m) in player_standings():
+        if m != 0:
+            raise ValueError("Reporting no matches should record none.")
+    # two rounds in one call -- later matches depend on earlier ones:
+    report_matches([(id1, id2), (id3, id4), (id1, id3), (id4, id2)])
+    correct = [(id1, 2, 2), (id3, 1, 2), (id4, 1, 2), (id2, 0, 2)]
+    user_results = [(i, w, m) for (i, n, w, m) in player_standings()]
+    if correct != user_results:
+        raise ValueError("After report_matches(), players should have \
+                         updated standings.")
+    print "11. Several matches can be reported at once."
+
+
+def test_pairings_after_writes():
+    delete_players()
+    [id1, id2, id3, id4] = register_players(["Cloudchaser", "Flitter",
+                                             "Thunderlane", "Blossomforth"])
+
+    def paired_ids():
+        return [(pid1, pid2) for (pid1, pname1, pid2, pname2)
+                in swiss_pairings()]
+
+    if paired_ids() != [(id1, id2), (id3, id4)]:
+        raise ValueError("Before any match, registered players should be \
+                         paired.")
+    id5 = register_player("Rumble")
+    id6 = register_player("Dumbbell")
+    if paired_ids() != [(id1, id2), (id3, id4), (id5, id6)]:
+        raise ValueError("swissPairings should include newly registered \
+                         players.")
+    report_match(id6, id1)
+    if paired_ids() != [(id6, id1)]:
+        raise ValueError("swissPairings should reflect report_match().")
+    report_matches([(id2, id3)])
+    if paired_ids() != [(id2, id6), (id1, id3)]:
+        raise ValueError("swissPairings should reflect report_matches().")
+    bulk_report_matches([(id4, id5, 0)])
+    if paired_ids() != [(id2, id4), (id6, id1), (id3, id5)]:
+        raise ValueError("swissPairings should reflect \
+                         bulk_report_matches().")
+    print "12. Pairings are recalculated after every reported change."
+
+
+def test_count_estimate():
+    delete_players()
+    register_players(["Lyra Heartstrings", "Bon Bon"])
+    # (the estimate is only refreshed by VACUUM/ANALYZE)
+    with connect() as (db, cursor):
+        cursor.execute("""ANALYZE players;""")
+    c = count_players(exact=False)
+    if c != 2:
+        raise ValueError("After analyzing, count_players(exact=False) \
+                         should estimate the two registered players.")
+    print "13. count_players() can return an estimated count."
+
+
+def test_bulk_report_tournaments():
+    delete_players()
+    [id1, id2, id3, id4] = register_players(["Cheese Sandwich",
+                                             "Coco Pommel", "Sassy Saddles",
+                                             "Coloratura"])
+    # rows of tournaments 1 & 2, interleaved:
+    bulk_report_matches([(id1, id2, 2), (id1, id2, 1), (id3, id4, 2),
+                         (id2, id1, 1), (id3, id1, 2), (id4, id3, 1)])
+    if [row[0] for row in player_standings(1)] != [id1, id2, id4, id3]:
+        raise ValueError("Imported matches should be ranked within \
+                         tournament 1.")
+    if [row[0] for row in player_standings(2)] != [id3, id1, id4, id2]:
+        raise ValueError("Imported matches should be ranked within \
+                         tournament 2.")
+    print "14. Matches of several tournaments can be imported at once."
+
+
 if __name__ == '__main__':
     test_delete_matches()
     test_delete()
@@ -148,4 +275,10 @@ if __name__ == '__main__':
     test_standings_before_matches()
     test_report_matches()
     test_pairings()
+    test_omw()
+    test_rematch_and_tournaments()
+    test_report_round()
+    test_pairings_after_writes()
+    test_count_estimate()
+    test_bulk_report_tournaments()
     print "Success!  All tests pass!"